@@ -1,74 +1,184 @@
 import streamlit as st
 import pandas as pd
-import yfinance as yf
+import numpy as np
 import requests
 import urllib3
-import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from curl_cffi import requests as curl_requests
+from urllib3.util.retry import Retry
+from lxml import html as lxml_html
+from cache import FileCache
+from scraper import fetch_taiwan_stock_data
+from strategy import score_batch
 
 # --- 1. 基礎設定 ---
 # 忽略 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 st.set_page_config(page_title="台股極速多空選股器", layout="wide")
 
+TW_TZ = ZoneInfo("Asia/Taipei")
+FILE_CACHE = FileCache(".cache")
+
+LISTING_URLS = {
+    "上市": ("https://isin.twse.com.tw/isin/C_public.jsp?strMode=2", ".TW"),
+    "上櫃": ("https://isin.twse.com.tw/isin/C_public.jsp?strMode=4", ".TWO"),
+}
+
+# Streamlit 每次互動都會重跑腳本，Session 放進 cache_resource 才能真正跨 rerun 重用連線
+@st.cache_resource(show_spinner=False)
+def get_session():
+    """共用的 HTTP Session：keep-alive 連線池，省去每次請求的 TCP/TLS 握手"""
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    # 短暫的握手失敗或 5xx 自動退避重試，避免一次網路抖動就讓清單變空
+    retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+    session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=100, max_retries=retries))
+    return session
+
+# 跨 rerun 與各下載批次共用同一組 cookie/crumb；curl handle 依執行緒各自建立，可安全並行
+@st.cache_resource(show_spinner=False)
+def get_yf_session():
+    """Yahoo 專用 Session：yfinance 需要 curl_cffi 的瀏覽器指紋，一般 requests Session 會被限流"""
+    return curl_requests.Session(impersonate="chrome")
+
+def _fetch(url):
+    # TWSE 憑證鏈常有問題，僅對此來源關閉驗證
+    res = get_session().get(url, verify=False, timeout=15)
+    return res.text
+
+def _parse_listing(text, suffix):
+    """直接以 lxml 取出每列第一格「代號　名稱」，不經過 DataFrame"""
+    tree = lxml_html.fromstring(text)
+    # 直接取文字節點，不為每個 <td> 組 text_content()
+    codes = (s.split('\u3000', 1)[0].strip() for s in tree.xpath('//tr/td[1]/text()'))
+    # dict.fromkeys 依原順序去重，避免重複代號在下載結果中產生重複欄位
+    return tuple(dict.fromkeys(c + suffix for c in codes if len(c) == 4 and c.isdigit()))
+
+def _listing_key(market_type):
+    suffix = LISTING_URLS[market_type][1].strip('.').lower()
+    return f"tickers_{suffix}_{datetime.now(TW_TZ):%Y%m%d}"
+
+def _load_listing(market_type):
+    url, suffix = LISTING_URLS[market_type]
+    try:
+        codes = _parse_listing(_fetch(url), suffix)
+    except Exception:
+        codes = ()
+    return list(codes) or None  # 抓取失敗的空清單不寫入快取
+
 # 關鍵修正：加入 show_spinner=False 避開 Python 3.13 執行緒錯誤
-@st.cache_data(ttl=86400, show_spinner=False)
+# 清單為不可變的 tuple，用 cache_resource 直接回傳參考，省去每次 rerun 的序列化與複製
+@st.cache_resource(ttl=86400, show_spinner=False)
+def get_all_stock_tickers():
+    """一次取得上市、上櫃兩份清單；先讀當日磁碟快取，冷啟動才抓 TWSE (不顯示預設 Spinner)"""
+    # 兩頁並行抓取，總耗時約等於最慢的一頁；已命中磁碟快取的市場不會發出請求
+    with ThreadPoolExecutor(max_workers=len(LISTING_URLS)) as ex:
+        futures = {
+            m: ex.submit(FILE_CACHE.get_or_fetch, _listing_key(m), lambda m=m: _load_listing(m), 86400)
+            for m in LISTING_URLS
+        }
+    return {m: tuple(f.result() or ()) for m, f in futures.items()}
+
+def refresh_stock_tickers():
+    """清除記憶體與當日磁碟快取，下次取用時重新抓取"""
+    get_all_stock_tickers.clear()
+    for m in LISTING_URLS:
+        FILE_CACHE.delete(_listing_key(m))
+
 def get_stock_tickers(market_type):
-    """抓取股票清單 (不顯示預設 Spinner)"""
-    url = "https://isin.twse.com.tw/isin/C_public.jsp?strMode=2" if market_type == "上市" else "https://isin.twse.com.tw/isin/C_public.jsp?strMode=4"
-    suffix = ".TW" if market_type == "上市" else ".TWO"
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    try:
-        res = requests.get(url, verify=False, headers=headers, timeout=15)
-        df = pd.read_html(res.text)[0]
-        df.columns = df.iloc[0]
-        df = df.iloc[1:]
-        df['code'] = df['有價證券代號及名稱'].astype(str).str.split('　').str[0]
-        valid_codes = df[df['code'].str.len() == 4]['code'].tolist()
-        return [c + suffix for c in valid_codes]
-    except:
-        return []
-
-def analyze_stock(ticker, df, mode="空方"):
-    """策略核心邏輯"""
-    try:
-        if not isinstance(df, pd.DataFrame) or 'Close' not in df.columns: return None
-        data = df.dropna()
-        if len(data) < 20: return None
-        
-        curr, prev = data.iloc[-1], data.iloc[-2]
-        ma5 = data['Close'].rolling(5).mean().iloc[-1]
-        ma20 = data['Close'].rolling(20).mean().iloc[-1]
-        vol_ma5 = data['Volume'].rolling(5).mean().iloc[-1]
-        bias = (curr['Close'] - ma20) / ma20
-        
-        score, reasons = 0, []
-        if mode == "空方":
-            if curr['Close'] < ma5: score += 1; reasons.append("破5MA")
-            if curr['Close'] < curr['Open']: score += 1; reasons.append("收黑K")
-            if bias > 0.05: score += 2; reasons.append("高乖離")
-            if curr['Close'] < prev['Close'] and curr['Volume'] > vol_ma5: score += 1; reasons.append("量增跌")
-        else:
-            if curr['Close'] > ma5: score += 1; reasons.append("突破5MA")
-            if curr['Close'] > curr['Open']: score += 1; reasons.append("收紅K")
-            if bias < -0.05: score += 2; reasons.append("跌深反彈")
-            if curr['Close'] > prev['Close'] and curr['Volume'] > vol_ma5: score += 1; reasons.append("量增漲")
-            
-        if score > 0:
-            return {
-                "代號": ticker, "收盤價": round(float(curr['Close']), 2),
-                "漲跌幅": f"{((curr['Close']-prev['Close'])/prev['Close']*100):.2f}%",
-                "評分": int(score), "符合訊號": "、".join(reasons),
-                "20MA乖離": f"{(bias*100):.2f}%", "成交量(張)": int(curr['Volume']/1000)
-            }
-    except: return None
+    """抓取股票清單"""
+    return get_all_stock_tickers().get(market_type, ())
+
+INTRADAY_TTL = 900
+
+def _ohlcv_ttl(now):
+    """收盤 (13:30) 前資料仍會變動，只快取 15 分鐘；收盤後當日資料即固定"""
+    return INTRADAY_TTL if now.hour * 60 + now.minute < 13 * 60 + 30 else 86400
+
+CHUNK_SIZE = 200
+# 流動性過濾與評分只用到開、收、量，High/Low 不進快取也不進後續矩陣
+OHLCV_FIELDS = ["Open", "Close", "Volume"]
+
+def _download_chunk(tickers, period):
+    # 外層執行緒池已負責並行，內層關閉 yfinance 自己的執行緒
+    data = fetch_taiwan_stock_data(tickers, period=period, threads=False, session=get_yf_session())
+    # 欄位統一為 (代號, 欄位) 兩層，呼叫端一律用 data[t] 取單檔，不必逐檔判斷或攤平
+    if not isinstance(data.columns, pd.MultiIndex):
+        data.columns = pd.MultiIndex.from_product([tickers, data.columns])
+    return data
+
+def _chunked_download(tickers, period):
+    """每 200 檔切成一批，以 8 條執行緒同時向 Yahoo 下載後橫向合併"""
+    chunks = [tickers[i:i + CHUNK_SIZE] for i in range(0, len(tickers), CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        parts = list(ex.map(lambda c: _download_chunk(c, period), chunks))
+    return pd.concat(parts, axis=1)
+
+@st.cache_data(ttl=INTRADAY_TTL, show_spinner=False)
+def download_ohlcv(tickers, period):
+    """批次下載 OHLCV；逐檔讀寫本地 Parquet 快取，只向 Yahoo 補抓未命中的代號"""
+    now = datetime.now(TW_TZ)
+    stamp = f"{now:%Y%m%d}"
+    frames, missing = {}, []
+    for t in tickers:
+        df = FILE_CACHE.get(f"{t}/{period}_{stamp}")
+        if df is None: missing.append(t)
+        else: frames[t] = df
+    
+    if missing:
+        data = _chunked_download(missing, period)
+        ttl = _ohlcv_ttl(now)
+        available = set(data.columns.get_level_values(0))
+        for t in missing:
+            if t not in available: continue
+            df = data[t][OHLCV_FIELDS]
+            if df.isna().all().all(): continue  # 抓取失敗或已下市，不寫入快取
+            frames[t] = df
+            FILE_CACHE.set(f"{t}/{period}_{stamp}", df, ttl)
+    
+    if not frames: return pd.DataFrame()
+    return pd.concat({t: frames[t] for t in tickers if t in frames}, axis=1)
+
+def filter_liquid(data, vol_threshold, short_side=True):
+    """第一階段：以 (日期, 標的) 矩陣一次算出流動性 / 股價 / 漲停遮罩"""
+    if data.empty: return []
+    closes = data.xs('Close', level=1, axis=1)
+    tickers = closes.columns
+    # 收盤價維持 float64，漲停判斷 (如 25 → 27.45 恰為 9.8%) 與原本逐檔 float 計算的結果一致
+    C = closes.to_numpy(dtype=np.float64)
+    # 成交量用 float64：大型股單日量常超過 float32 可精確表示的 2^24 股
+    V = data.xs('Volume', level=1, axis=1)[tickers].to_numpy(dtype=np.float64)
+    valid = ~(np.isnan(C) | np.isnan(V))
+    
+    # 由最後一天往回找每檔最近兩筆有效資料 (只迴圈日期，不迴圈標的)
+    last_close, prev_close, last_vol = (np.full(len(tickers), np.nan) for _ in range(3))
+    for row in range(len(C) - 1, -1, -1):
+        m = valid[row]
+        take_prev = m & ~np.isnan(last_close) & np.isnan(prev_close)
+        prev_close[take_prev] = C[row, take_prev]
+        take_last = m & np.isnan(last_close)
+        last_close[take_last] = C[row, take_last]
+        last_vol[take_last] = V[row, take_last]
+    
+    mask = ~np.isnan(prev_close) & (last_vol >= vol_threshold) & (last_close > 20)
+    if short_side:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mask &= ~((last_close - prev_close) / prev_close >= 0.098)
+    return tickers[mask].tolist()
 
 # --- 2. Sidebar 設定 ---
 st.sidebar.title("⚙️ 參數設定")
 market_choice = st.sidebar.selectbox("1. 市場類型", ["上市", "上櫃"])
 trade_mode = st.sidebar.radio("2. 交易方向", ["空方當沖 (Short)", "多方當沖 (Long)"])
 min_score = st.sidebar.slider("3. 評分門檻", 1, 5, 3)
+if st.sidebar.button("🔄 重新抓取股票清單"):
+    refresh_stock_tickers()
 
 VOL_THRESHOLD = 3000000 
+SINGLE_PASS_LIMIT = 2500
 
 # --- 3. UI 呈現 ---
 st.title(f"🚀 台股極速多空選股器 ({market_choice})")
@@ -78,6 +188,8 @@ if st.button(f"🔍 開始{market_choice}股票掃描"):
     # 使用 st.status 完全取代 st.spinner 以確保相容性
     with st.status(f"正在掃描 {market_choice} 市場...", expanded=True) as status:
         status.write("正在抓取股票清單...")
+        # 進度條只在每個階段結束時更新一次，避免逐檔推送前端
+        p_bar = st.progress(0)
         all_tickers = get_stock_tickers(market_choice)
         
         if not all_tickers: 
@@ -85,46 +197,36 @@ if st.button(f"🔍 開始{market_choice}股票掃描"):
             st.stop()
         
         status.write("第一階段：正在過濾成交量 > 3000 張之標的...")
+        # 一般全市場規模直接抓一個月資料、在記憶體內過濾，省掉第二次下載；超大清單才分兩段
+        single_pass = len(all_tickers) <= SINGLE_PASS_LIMIT
         try:
-            fast_data = yf.download(all_tickers, period="3d", group_by='ticker', progress=False, threads=True)
+            fast_data = download_ohlcv(all_tickers, "1mo" if single_pass else "3d")
         except Exception as e:
             status.update(label=f"數據下載失敗: {e}", state="error")
             st.stop()
 
-        qualified_tickers = []
-        for t in all_tickers:
-            try:
-                temp_df = fast_data[t].dropna() if len(all_tickers) > 1 else fast_data.dropna()
-                if temp_df.empty: continue
-                last_close, prev_close, last_vol = float(temp_df['Close'].iloc[-1]), float(temp_df['Close'].iloc[-2]), float(temp_df['Volume'].iloc[-1])
-                is_limit_up = (last_close - prev_close) / prev_close >= 0.098
-                
-                if last_vol >= VOL_THRESHOLD and last_close > 20:
-                    if trade_mode.startswith("空方") and is_limit_up: continue
-                    qualified_tickers.append(t)
-            except: continue
+        liquidity_view = fast_data.iloc[-3:] if single_pass else fast_data
+        qualified_tickers = filter_liquid(liquidity_view, VOL_THRESHOLD, short_side=trade_mode.startswith("空方"))
         
+        p_bar.progress(0.5)
         status.write(f"✅ 第一階段完成！篩選出 {len(qualified_tickers)} 隻標的。")
         
-        results = []
         if qualified_tickers:
             status.write("第二階段：正在進行深度指標分析...")
-            detail_data = yf.download(qualified_tickers, period="1mo", group_by='ticker', progress=False, threads=True)
-            
-            p_bar = st.progress(0)
-            for i, t in enumerate(qualified_tickers):
-                df_to_analyze = detail_data[t] if len(qualified_tickers) > 1 else detail_data
-                res = analyze_stock(t, df_to_analyze, mode=trade_mode[:2])
-                if res and res['評分'] >= min_score:
-                    results.append(res)
-                p_bar.progress((i + 1) / len(qualified_tickers))
+            detail_data = fast_data if single_pass else download_ohlcv(tuple(qualified_tickers), "1mo")
+            final_df = score_batch(detail_data, qualified_tickers, mode=trade_mode[:2], min_score=min_score)
+            p_bar.progress(1.0)
             
             status.update(label="✅ 掃描完成！", state="complete", expanded=False)
             
-            if results:
-                final_df = pd.DataFrame(results).sort_values(by="評分", ascending=False)
+            if not final_df.empty:
                 st.success(f"🔥 符合 {min_score} 分以上標的：")
-                st.dataframe(final_df, use_container_width=True)
+                # 數值欄維持數值型態，由前端在顯示時格式化
+                st.dataframe(final_df, use_container_width=True, column_config={
+                    "收盤價": st.column_config.NumberColumn(format="%.2f"),
+                    "漲跌幅": st.column_config.NumberColumn(format="%.2f%%"),
+                    "20MA乖離": st.column_config.NumberColumn(format="%.2f%%"),
+                })
                 
                 st.markdown("---")
                 st.subheader("📊 策略評分權重說明")
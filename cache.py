@@ -0,0 +1,52 @@
+import json
+import time
+from pathlib import Path
+
+import pandas as pd
+
+class FileCache:
+    """
+    本地檔案快取：DataFrame 存成 Parquet、其餘資料存成 JSON，旁邊的 .meta.json 記錄建立時間與 TTL
+    key 可含 '/'，例如 '2330.TW/1mo_20250101' 會存成 .cache/2330.TW/1mo_20250101.parquet
+    """
+    def __init__(self, root=".cache"):
+        self.root = Path(root)
+
+    def _meta_path(self, key):
+        return self.root / f"{key}.meta.json"
+
+    def get(self, key):
+        """命中且未過期時回傳快取值，否則回傳 None"""
+        try:
+            meta = json.loads(self._meta_path(key).read_text())
+            if time.time() - meta["created_ts"] > meta["ttl_s"]: return None
+            path = self.root / f"{key}.{meta.get('format', 'parquet')}"
+            if path.suffix == ".json": return json.loads(path.read_text())
+            # 以 memory map 讀取，省去先整檔複製進記憶體緩衝區
+            return pd.read_parquet(path, engine="pyarrow", memory_map=True)
+        except Exception:
+            return None
+
+    def set(self, key, value, ttl):
+        fmt = "parquet" if isinstance(value, pd.DataFrame) else "json"
+        path = self.root / f"{key}.{fmt}"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if fmt == "parquet": value.to_parquet(path, engine="pyarrow", compression="zstd")
+            else: path.write_text(json.dumps(value, ensure_ascii=False))
+            self._meta_path(key).write_text(json.dumps({"created_ts": time.time(), "ttl_s": ttl, "format": fmt}))
+        except Exception:
+            pass  # 快取寫入失敗不影響主流程
+
+    def get_or_fetch(self, key, fetcher, ttl):
+        """命中直接回傳；未命中才呼叫 fetcher 取值並寫入，fetcher 回傳 None 時不寫入"""
+        value = self.get(key)
+        if value is None:
+            value = fetcher()
+            if value is not None: self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        """刪除 meta 與資料檔；格式不需先讀 meta 判斷，兩種副檔名都清掉，避免留下孤兒檔"""
+        for path in (self._meta_path(key), self.root / f"{key}.parquet", self.root / f"{key}.json"):
+            path.unlink(missing_ok=True)
@@ -1,13 +1,16 @@
 import yfinance as yf
 import pandas as pd
 
-def fetch_taiwan_stock_data(ticker_list, period="3mo"):
+def fetch_taiwan_stock_data(ticker_list, period="3mo", threads=True, session=None):
     """
     批次抓取台股歷史資料
     ticker_list: ['2330.TW', '2317.TW', ...]
+    threads: 呼叫端已自行並行時傳 False，關閉 yfinance 內部執行緒
+    session: 共用的 curl_cffi Session；None 時由 yfinance 每次自建
     """
     # 抓取 OHLCV 資料
-    data = yf.download(ticker_list, period=period, interval="1d", group_by='ticker')
+    # 一次送出整批代號，由 yfinance 內部多執行緒抓取，避免逐檔往返
+    data = yf.download(ticker_list, period=period, interval="1d", group_by='ticker', threads=threads, progress=False, session=session)
     return data
 
 def get_universe():
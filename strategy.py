@@ -1,37 +1,247 @@
+import numpy as np
 import pandas as pd
 
-def analyze_short_opportunity(ticker, df):
+try:
+    from numba import njit, prange, guvectorize, float64, int8
+except ImportError:  # numba 為選用依賴，未安裝時改走 NumPy 向量化版本
+    njit = guvectorize = None
+
+# 均線一律照 pandas rolling(w).mean() 的算法求值，平手 (收盤恰等於均線) 的判定才與逐檔 pandas 版相同：
+# 直接相加再除以視窗長度會因捨入差 1 ulp，tick 價位 (54.6、35.55) 或還原權值後的價格都可能翻轉破線/突破
+def _rolling_mean(x, w):
+    """NumPy 版：x 為 (n_tickers, n_days)，沿日期軸直接交給 pandas 計算，NaN 視為無資料"""
+    return pd.DataFrame(x.T).rolling(w).mean().to_numpy().T
+
+if njit is not None:
+    @njit(cache=True)
+    def _rolling_mean_nb(x, w):
+        """Numba 版：逐步重現 pandas roll_mean (Kahan 補償的加入/移除，連續同值視窗直接回傳該值)，與 pandas 逐位元相同"""
+        n = x.shape[0]
+        out = np.full(n, np.nan)
+        sum_x = comp_add = comp_remove = 0.0
+        nobs = neg_ct = same_ct = 0
+        prev_value = np.float64(x[0]) if n else np.nan
+        for j in range(n):
+            if j >= w:
+                val = np.float64(x[j - w])
+                if val == val:
+                    nobs -= 1
+                    y = -val - comp_remove
+                    t = sum_x + y
+                    comp_remove = t - sum_x - y
+                    sum_x = t
+                    if np.signbit(val): neg_ct -= 1
+            val = np.float64(x[j])
+            if val == val:
+                nobs += 1
+                y = val - comp_add
+                t = sum_x + y
+                comp_add = t - sum_x - y
+                sum_x = t
+                if np.signbit(val): neg_ct += 1
+                same_ct = same_ct + 1 if val == prev_value else 1
+                prev_value = val
+            if nobs >= w and nobs > 0:
+                if same_ct >= nobs:
+                    out[j] = prev_value
+                else:
+                    r = sum_x / nobs
+                    if neg_ct == 0 and r < 0: r = 0.0
+                    elif neg_ct == nobs and r > 0: r = 0.0
+                    out[j] = r
+        return out
+
+def _short_opportunity_numpy(closes, opens, vols):
     """
-    針對單一股票進行空方評分
+    空方評分：輸入 (n_rows, n_days) 陣列 (n_days >= 20)，每列一檔，回傳 (score, bias)
+    輸入一律以 float64 計算 (float32 會先轉型)；均線由 _rolling_mean 求得，與逐檔 rolling().mean() 相同
     """
-    if len(df) < 20: return None
-    
-    last_close = df['Close'].iloc[-1]
-    prev_close = df['Close'].iloc[-2]
-    ma5 = df['Close'].rolling(5).mean().iloc[-1]
-    ma20 = df['Close'].rolling(20).mean().iloc[-1]
-    volume_ma5 = df['Volume'].rolling(5).mean().iloc[-1]
-    
-    score = 0
+    closes, opens, vols = (np.asarray(a, dtype=np.float64) for a in (closes, opens, vols))
+    last_close, prev_close = closes[:, -1], closes[:, -2]
+    # 今日與昨日的 5MA 取自同一條 rolling 序列
+    ma5_series = _rolling_mean(closes, 5)
+    ma5_prev, ma5 = ma5_series[:, -2], ma5_series[:, -1]
+    ma20 = _rolling_mean(closes, 20)[:, -1]
+    volume_ma5 = _rolling_mean(vols, 5)[:, -1]
+    bias = (last_close - ma20) / ma20
     
     # 條件 1：跌破 5 日線 (短期轉弱)
-    if last_close < ma5: score += 1
-    
     # 條件 2：5 日線下彎 (趨勢向下)
-    if ma5 < df['Close'].rolling(5).mean().iloc[-2]: score += 1
-    
     # 條件 3：今日出量下跌 (恐慌性拋售或主力出貨)
-    if last_close < prev_close and df['Volume'].iloc[-1] > volume_ma5:
-        score += 1
-        
-    # 條件 4：乖離率過大後的首根長黑 (過熱反轉)
-    bias = (last_close - ma20) / ma20
-    if bias > 0.07 and last_close < df['Open'].iloc[-1]: # 正乖離 > 7% 且收黑
-        score += 2 
+    # 條件 4：乖離率過大後的首根長黑 (過熱反轉)：正乖離 > 7% 且收黑
+    score = ((last_close < ma5).astype(np.int8)
+             + (ma5 < ma5_prev)
+             + ((last_close < prev_close) & (vols[:, -1] > volume_ma5))
+             + 2 * ((bias > 0.07) & (last_close < opens[:, -1])))
+    return score, bias
+
+if guvectorize is not None:
+    # 型別契約：只編譯 float64 版本，float32 輸入由 ufunc 機制先轉成 float64；
+    # 均線以 _rolling_mean_nb 對整條序列求值，平盤/持平視窗的判定與 NumPy 版、pandas rolling 相同
+    @guvectorize([(float64[:], float64[:], float64[:], int8[:], float64[:])],
+                 '(n),(n),(n)->(),()', nopython=True, cache=True)
+    def _short_opportunity_gufunc(close, open_, vol, score, bias):
+        """Numba gufunc 版空方評分：每列一檔；呼叫端一次只送一列，用預設 cpu target，不付平行排程的啟動成本"""
+        last, prev = close[-1], close[-2]
+        # 直接 .mean() 在還原權值後的持平價位上會差 1 ulp 而誤判破線，均線一律照 pandas 的算法求值
+        ma5_series = _rolling_mean_nb(close, 5)
+        ma5, ma5_prev = ma5_series[-1], ma5_series[-2]
+        ma20 = _rolling_mean_nb(close, 20)[-1]
+        vol_ma5 = _rolling_mean_nb(vol, 5)[-1]
+        b = (last - ma20) / ma20
+        # 條件以整數位元運算組合，不用 and 的短路分支，整段為直線程式碼
+        score[0] = (int(last < ma5) + int(ma5 < ma5_prev)
+                    + (int(last < prev) & int(vol[-1] > vol_ma5))
+                    + 2 * (int(b > 0.07) & int(last < open_[-1])))
+        bias[0] = b
+
+    # 型別簽章已明確給定，匯入時即完成編譯 (cache=True 時直接讀磁碟快取)，首次掃描不必等待
+    score_short_opportunity = _short_opportunity_gufunc
+else:
+    score_short_opportunity = _short_opportunity_numpy
+
+def analyze_short_opportunity(ticker, df):
+    """
+    針對單一股票進行空方評分
+    """
+    if len(df) < 20: return None
+    
+    # 單檔包成一列的 (1, n_days) 輸入，NumPy 版與 gufunc 版共用同一個介面
+    close, open_, vol = (df[c].to_numpy(dtype=np.float64)[None, :] for c in ('Close', 'Open', 'Volume'))
+    score, bias = score_short_opportunity(close, open_, vol)
+    last_close, bias = close[0, -1], bias[0]
 
     return {
         'Ticker': ticker,
-        'Close': round(last_close, 2),
-        'Score': score,
-        'Bias_20MA': f"{round(bias*100, 2)}%"
+        'Close': round(float(last_close), 2),
+        'Score': int(score[0]),
+        # 加 0.0 把 -0.0 轉成 0.0，避免顯示 "-0.0%"
+        'Bias_20MA': f"{round(bias*100, 2) + 0.0}%"
     }
+
+
+# 四個訊號的權重 (1, 1, 2, 1)；flags 為 4-bit 遮罩，分數直接查表，不必逐條件分支累加
+SIGNAL_WEIGHTS = (1, 1, 2, 1)
+SCORE_LUT = np.array([sum(w for i, w in enumerate(SIGNAL_WEIGHTS) if f >> i & 1) for f in range(16)], dtype=np.int8)
+
+def _score_numpy(closes, opens, vols, short):
+    """NumPy 版評分：輸入 (n_tickers, n_days) 陣列 (每檔有效資料靠右、前段補 NaN)，回傳 (score, flags, bias)"""
+    last_close, prev_close, vol_now = closes[:, -1], closes[:, -2], vols[:, -1]
+    ma5 = _rolling_mean(closes, 5)[:, -1]
+    ma20 = _rolling_mean(closes, 20)[:, -1]
+    vol_ma5 = _rolling_mean(vols, 5)[:, -1]
+    bias = (last_close - ma20) / ma20
+    
+    if short:
+        conds = (last_close < ma5, last_close < opens[:, -1], bias > 0.05,
+                 (last_close < prev_close) & (vol_now > vol_ma5))
+    else:
+        conds = (last_close > ma5, last_close > opens[:, -1], bias < -0.05,
+                 (last_close > prev_close) & (vol_now > vol_ma5))
+    flags = np.zeros(len(closes), dtype=np.uint8)
+    for i, c in enumerate(conds):
+        flags |= c.astype(np.uint8) << i
+    return SCORE_LUT[flags], flags, bias
+
+def _make_numba_kernel(short):
+    """依多空方向特化出專屬 kernel：short 為閉包常數，編譯時即消去方向分支"""
+    # 不開 fastmath：均線須與 pandas 逐位元相同，不允許編譯器重排或近似浮點運算
+    @njit(parallel=True, cache=True)
+    def kernel(closes, opens, vols):
+        """Numba 版評分：以 prange 將標的分配到多核心；均線由 _rolling_mean_nb 求得，與 pandas rolling 相同"""
+        n = closes.shape[0]
+        score = np.zeros(n, dtype=np.int8)
+        flags = np.zeros(n, dtype=np.uint8)
+        bias = np.empty(n, dtype=np.float64)
+        for i in prange(n):
+            c = closes[i]
+            v = vols[i]
+            last, prev, open_, vol_now = c[-1], c[-2], opens[i, -1], v[-1]
+            ma5 = _rolling_mean_nb(c, 5)[-1]
+            ma20 = _rolling_mean_nb(c, 20)[-1]
+            vol_ma5 = _rolling_mean_nb(v, 5)[-1]
+            b = (last - ma20) / ma20
+            vol_up = int(vol_now > vol_ma5)
+            if short:
+                f = int(last < ma5) | int(last < open_) << 1 | int(b > 0.05) << 2 | (int(last < prev) & vol_up) << 3
+            else:
+                f = int(last > ma5) | int(last > open_) << 1 | int(b < -0.05) << 2 | (int(last > prev) & vol_up) << 3
+            score[i] = SCORE_LUT[f]
+            flags[i] = f
+            bias[i] = b
+        return score, flags, bias
+    return kernel
+
+def _make_numpy_kernel(short):
+    def kernel(closes, opens, vols):
+        return _score_numpy(closes, opens, vols, short)
+    return kernel
+
+# 方向在匯入時就決定好，呼叫端依模式取一次 kernel，迴圈內不再判斷多空
+_make_kernel = _make_numpy_kernel if njit is None else _make_numba_kernel
+SCORE_KERNELS = {"空方": _make_kernel(True), "多方": _make_kernel(False)}
+
+WINDOW = 20
+SIGNALS = {
+    "空方": ("破5MA", "收黑K", "高乖離", "量增跌"),
+    "多方": ("突破5MA", "收紅K", "跌深反彈", "量增漲"),
+}
+# 4-bit 訊號遮罩 → 訊號文字，16 種組合預先組好，輸出時直接查表
+REASON_LUT = {
+    mode: tuple("、".join(l for i, l in enumerate(labels) if f >> i & 1) for f in range(16))
+    for mode, labels in SIGNALS.items()
+}
+
+# 文字欄直接用 Arrow 字串型別，不落成 object 欄，交給 Streamlit 序列化時不必再逐元素轉換
+TEXT_DTYPE = "string[pyarrow]"
+
+def _stack_windows(data, tickers):
+    """把每檔的有效 K 線靠右疊成 (n_tickers, n_days) 的 SoA 陣列，前段不足處補 NaN"""
+    # 只處理下載結果中真的存在的代號，不靠例外處理跳過缺漏標的
+    available = set(data.columns.get_level_values(0))
+    present = [t for t in tickers if t in available]
+    if not present or len(data) < WINDOW: return [], None, None, None
+    
+    # 以 xs 一次取出 (日期, 標的) 價量矩陣；之後只做 NumPy 索引，不再逐檔切 data[t]
+    # 價格維持 float64：台股 tick 價位 (如 54.6、35.55) 轉成 float32 後，5MA 與收盤價恰好相等的平手會被打破
+    C = data.xs('Close', level=1, axis=1)[present].to_numpy(dtype=np.float64)
+    O = data.xs('Open', level=1, axis=1)[present].to_numpy(dtype=np.float64)
+    # 成交量同樣用 float64 (float32 只能精確表示到 2^24 ≈ 1677 萬股)，缺值以 NaN 表示
+    V = data.xs('Volume', level=1, axis=1)[present].to_numpy(dtype=np.float64)
+    ok = ~(np.isnan(C) | np.isnan(O) | np.isnan(V))
+    keep = ok.sum(0) >= WINDOW
+    if not keep.any(): return [], None, None, None
+    
+    # 等同逐檔 dropna：穩定排序讓缺值列排到前面、有效列依原順序靠右，
+    # 補上的 NaN 在 rolling 中視為無資料，均線與 pandas 對 dropna 後序列的結果相同 (需保留完整歷史，不能只留尾端)
+    order = np.argsort(ok[:, keep], axis=0, kind="stable")
+    filled = np.take_along_axis(ok[:, keep], order, 0)
+    closes, opens, vols = (
+        np.ascontiguousarray(np.where(filled, np.take_along_axis(M[:, keep], order, 0), np.nan).T)
+        for M in (C, O, V)
+    )
+    return [t for t, k in zip(present, keep) if k], closes, opens, vols
+
+def score_batch(data, tickers, mode="空方", min_score=1):
+    """策略核心邏輯：所有標的一次做向量化評分，只為達門檻者組裝輸出欄位 (依評分由高到低)
+    data 為 yf.download(group_by='ticker') 的 (代號, 欄位) 兩層欄位 DataFrame
+    """
+    valid, closes, opens, vols = _stack_windows(data, tickers)
+    if not valid: return pd.DataFrame()
+    
+    score, flags, bias = SCORE_KERNELS[mode](closes, opens, vols)
+    last_close, prev_close, vol_now = closes[:, -1], closes[:, -2], vols[:, -1]
+    
+    # 達門檻的列直接依評分由高到低排好 (同分維持原順序)，輸出表不必再經 pandas 排序
+    hit = np.flatnonzero(score >= max(min_score, 1))
+    hit = hit[np.argsort(-score[hit], kind="stable")]
+    lut = REASON_LUT[mode]
+    reasons = [lut[f] for f in flags[hit]]
+    pct = (last_close - prev_close) / prev_close
+    # 以欄為單位、明確指定 dtype 組表，免去 pandas 的型別推斷
+    return pd.DataFrame({
+        "代號": pd.array(np.asarray(valid)[hit], dtype=TEXT_DTYPE), "收盤價": last_close[hit].astype(np.float32),
+        "漲跌幅": (pct[hit] * 100).astype(np.float32),
+        "評分": score[hit].astype(np.int8), "符合訊號": pd.array(reasons, dtype=TEXT_DTYPE),
+        "20MA乖離": (bias[hit] * 100).astype(np.float32), "成交量(張)": (vol_now[hit] // 1000).astype(np.int32)
+    })
@@ -0,0 +1,51 @@
+import json
+
+import pandas as pd
+
+from cache import FileCache
+
+def test_dataframe_round_trip(tmp_path):
+    cache = FileCache(tmp_path)
+    df = pd.DataFrame({"Close": [54.6, 35.55], "Volume": [3_000_000, 12_345_678]})
+    cache.set("2330.TW/1mo_20250101", df, ttl=60)
+    assert (tmp_path / "2330.TW" / "1mo_20250101.parquet").exists()
+    pd.testing.assert_frame_equal(cache.get("2330.TW/1mo_20250101"), df)
+
+def test_json_round_trip(tmp_path):
+    cache = FileCache(tmp_path)
+    cache.set("listing_上市", ["1101.TW", "2330.TW"], ttl=60)
+    assert cache.get("listing_上市") == ["1101.TW", "2330.TW"]
+
+def test_missing_key_returns_none(tmp_path):
+    assert FileCache(tmp_path).get("nope") is None
+
+def test_expired_entry_returns_none(tmp_path):
+    cache = FileCache(tmp_path)
+    cache.set("k", {"a": 1}, ttl=60)
+    meta_path = tmp_path / "k.meta.json"
+    meta = json.loads(meta_path.read_text())
+    meta["created_ts"] -= 61
+    meta_path.write_text(json.dumps(meta))
+    assert cache.get("k") is None
+
+def test_delete_removes_data_and_meta(tmp_path):
+    cache = FileCache(tmp_path)
+    cache.set("a/df", pd.DataFrame({"x": [1]}), ttl=60)
+    cache.set("obj", [1, 2], ttl=60)
+    for key in ("a/df", "obj", "never-set"):
+        cache.delete(key)
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+    assert cache.get("a/df") is None and cache.get("obj") is None
+
+def test_get_or_fetch(tmp_path):
+    cache = FileCache(tmp_path)
+    calls = []
+    def fetcher():
+        calls.append(1)
+        return [1, 2, 3]
+    assert cache.get_or_fetch("k", fetcher, ttl=60) == [1, 2, 3]
+    assert cache.get_or_fetch("k", fetcher, ttl=60) == [1, 2, 3]
+    assert len(calls) == 1
+    # fetcher 回傳 None 時不寫入快取
+    assert cache.get_or_fetch("none", lambda: None, ttl=60) is None
+    assert not (tmp_path / "none.meta.json").exists()
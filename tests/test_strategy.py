@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import strategy
+
+# 5MA 與收盤價恰好相等的視窗：價位不是 float32 可精確表示的值，直接相加再除會差 1 ulp 而翻成破線/突破
+TIE_WINDOWS = [
+    [54.7, 54.6, 54.5, 54.6, 54.6],
+    [35.55, 35.65, 35.7, 35.5, 35.6],
+    [54.6] * 5,
+    [35.55] * 5,
+]
+
+KERNELS = [pytest.param(strategy._make_numpy_kernel, id="numpy")]
+if strategy.njit is not None:
+    KERNELS.append(pytest.param(strategy._make_numba_kernel, id="numba"))
+
+def _tie_frame(window, n=25):
+    """前段收盤固定在 window[0]，最後 5 根為 window；開盤等於收盤、量能持平，只剩均線條件可能成立"""
+    close = np.array([window[0]] * (n - len(window)) + list(window))
+    return close[None, :], close[None, :].copy(), np.full((1, n), 3_000_000.0)
+
+@pytest.mark.parametrize("window", TIE_WINDOWS)
+def test_rolling_mean_matches_pandas(window):
+    close, _, _ = _tie_frame(window)
+    expected = pd.Series(close[0]).rolling(5).mean().to_numpy()
+    np.testing.assert_array_equal(strategy._rolling_mean(close, 5)[0], expected)
+    if strategy.njit is not None:
+        np.testing.assert_array_equal(strategy._rolling_mean_nb(close[0], 5), expected)
+
+def test_rolling_mean_skips_leading_nan():
+    x = np.r_[np.nan, np.nan, np.nan, 10.1, 10.2, 10.3, 10.4, 10.5, 10.6]
+    expected = pd.Series(x).dropna().rolling(5).mean().iloc[-1]
+    assert strategy._rolling_mean(x[None, :], 5)[0, -1] == expected
+    if strategy.njit is not None:
+        assert strategy._rolling_mean_nb(x, 5)[-1] == expected
+
+@pytest.mark.parametrize("make", KERNELS)
+@pytest.mark.parametrize("window", TIE_WINDOWS)
+def test_tie_not_flagged(make, window):
+    close, open_, vol = _tie_frame(window)
+    ma5 = pd.Series(close[0]).rolling(5).mean().iloc[-1]
+    assert ma5 == close[0, -1]
+    for short in (True, False):
+        _, flags, _ = make(short)(close, open_, vol)
+        assert not flags[0] & 1
+
+SHORT_PATHS = [pytest.param(strategy._short_opportunity_numpy, id="numpy")]
+if strategy.guvectorize is not None:
+    SHORT_PATHS.append(pytest.param(strategy._short_opportunity_gufunc, id="gufunc"))
+
+@pytest.mark.parametrize("scorer", SHORT_PATHS)
+@pytest.mark.parametrize("price", [54.6 * 0.9731, 35.55 * 0.8867, 1503.0 * 0.95])
+def test_short_opportunity_flat_adjusted(monkeypatch, scorer, price):
+    # 還原權值後的持平價位落在 tick 之外，均線須恰等於收盤：不得判定破 5MA，乖離顯示 "0.0%" 而非 "-0.0%"
+    monkeypatch.setattr(strategy, "score_short_opportunity", scorer)
+    df = pd.DataFrame({"Open": price, "Close": price, "Volume": 3_000_000.0}, index=range(25))
+    result = strategy.analyze_short_opportunity("2330.TW", df)
+    assert result["Score"] == 0
+    assert result["Bias_20MA"] == "0.0%"
+
+def _baseline_analyze_stock(ticker, df, mode):
+    """原 app.py 的逐檔評分 (pandas rolling)，作為 score_batch 的對照基準"""
+    data = df.dropna()
+    if len(data) < 20: return None
+    curr, prev = data.iloc[-1], data.iloc[-2]
+    ma5 = data['Close'].rolling(5).mean().iloc[-1]
+    ma20 = data['Close'].rolling(20).mean().iloc[-1]
+    vol_ma5 = data['Volume'].rolling(5).mean().iloc[-1]
+    bias = (curr['Close'] - ma20) / ma20
+    
+    score, reasons = 0, []
+    if mode == "空方":
+        if curr['Close'] < ma5: score += 1; reasons.append("破5MA")
+        if curr['Close'] < curr['Open']: score += 1; reasons.append("收黑K")
+        if bias > 0.05: score += 2; reasons.append("高乖離")
+        if curr['Close'] < prev['Close'] and curr['Volume'] > vol_ma5: score += 1; reasons.append("量增跌")
+    else:
+        if curr['Close'] > ma5: score += 1; reasons.append("突破5MA")
+        if curr['Close'] > curr['Open']: score += 1; reasons.append("收紅K")
+        if bias < -0.05: score += 2; reasons.append("跌深反彈")
+        if curr['Close'] > prev['Close'] and curr['Volume'] > vol_ma5: score += 1; reasons.append("量增漲")
+    if score > 0:
+        return {
+            "代號": ticker, "收盤價": round(float(curr['Close']), 2),
+            "漲跌幅": (curr['Close'] - prev['Close']) / prev['Close'] * 100,
+            "評分": int(score), "符合訊號": "、".join(reasons),
+            "20MA乖離": bias * 100, "成交量(張)": int(curr['Volume'] / 1000)
+        }
+
+def _tick(p):
+    """台股升降單位"""
+    return np.select([p < 10, p < 50, p < 100, p < 500, p < 1000], [0.01, 0.05, 0.1, 0.5, 1.0], 5.0)
+
+def _random_market(rng, n_tickers=60, adjusted=False):
+    """tick 價位上的隨機漫步；每 5 檔一檔持平 (製造 5MA 平手)，每 3 檔一檔挖掉幾個缺值；adjusted 時乘上還原權值係數"""
+    n_days = int(rng.integers(22, 60))
+    frames = {}
+    for k in range(n_tickers):
+        close = [float(np.round(rng.uniform(8, 1500) / 0.05) * 0.05)]
+        for _ in range(n_days - 1):
+            step = 0 if k % 5 == 0 else rng.integers(-3, 4)
+            close.append(max(float(_tick(close[-1])), close[-1] + step * float(_tick(close[-1]))))
+        close = np.round(np.array(close), 2)
+        open_ = np.round(close + rng.integers(-2, 3, n_days) * _tick(close), 2)
+        if adjusted:
+            factor = rng.uniform(0.8, 0.99)
+            close, open_ = close * factor, open_ * factor
+        df = pd.DataFrame({"Open": open_, "Close": close,
+                           "Volume": rng.integers(1000, 40000, n_days) * 1000.0})
+        if k % 3 == 0:
+            rows = rng.choice(n_days, int(rng.integers(1, 5)), replace=False)
+            df.iloc[rows, int(rng.integers(0, 3))] = np.nan
+        frames[f"{1101 + k}.TW"] = df
+    return frames, pd.concat(frames, axis=1)
+
+@pytest.mark.parametrize("make", KERNELS)
+@pytest.mark.parametrize("mode", ["空方", "多方"])
+@pytest.mark.parametrize("adjusted", [False, True], ids=["tick", "adjusted"])
+@pytest.mark.parametrize("seed", range(5))
+def test_score_batch_matches_baseline(monkeypatch, make, mode, adjusted, seed):
+    monkeypatch.setitem(strategy.SCORE_KERNELS, mode, make(mode == "空方"))
+    frames, data = _random_market(np.random.default_rng(seed), adjusted=adjusted)
+    min_score = 2
+    
+    rows = [r for t, df in frames.items() if (r := _baseline_analyze_stock(t, df, mode)) and r["評分"] >= min_score]
+    expected = pd.DataFrame(rows).sort_values(by="評分", ascending=False, kind="stable").reset_index(drop=True)
+    result = strategy.score_batch(data, list(frames), mode=mode, min_score=min_score)
+    
+    assert list(result["代號"]) == list(expected["代號"])
+    assert list(result["評分"]) == list(expected["評分"])
+    assert list(result["符合訊號"]) == list(expected["符合訊號"])
+    assert list(result["成交量(張)"]) == list(expected["成交量(張)"])
+    # 數值欄為 float32 顯示用，只比對到小數第二位
+    for col in ("收盤價", "漲跌幅", "20MA乖離"):
+        np.testing.assert_allclose(result[col], expected[col], atol=5e-3)
+
+def test_score_batch_skips_short_and_missing_tickers():
+    frames, data = _random_market(np.random.default_rng(0), n_tickers=3)
+    short = frames["1102.TW"].iloc[-19:]
+    data = pd.concat({**frames, "1102.TW": short}, axis=1)
+    result = strategy.score_batch(data, ["1101.TW", "1102.TW", "9999.TW"], min_score=0)
+    assert "1102.TW" not in set(result["代號"]) and "9999.TW" not in set(result["代號"])